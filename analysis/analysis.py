@@ -2,19 +2,24 @@ from matplotlib import pyplot as plt
 from data.data_request import Token_Pair
 from data.market import Automted_Market_Maker
 from simulation.simulation import Simulation
+import numpy as np
 import pandas as pd
+from typing import Sequence, Tuple, Union
 
 
-def get_initial_drawdown(series: pd.Series) -> float:
+def get_initial_drawdown(series: Union[pd.Series, np.ndarray]) -> Union[float, np.ndarray]:
     """Computes the maximum drawdown from the first data point in the series.
 
     Args:
-        series (pd.Series): A time series object containing price return data.
+        series (Union[pd.Series, np.ndarray]): A time series object containing price return data,
+            or a 2D array with one time series per column.
 
     Returns:
-        float: The highest drawdown from the first data point in the series
+        Union[float, np.ndarray]: The highest drawdown from the first data point in the series,
+            or one drawdown per column for a 2D array
     """
-    return min(series) / series[0] - 1
+    arr = np.asarray(series)
+    return arr.min(axis=0) / arr[0] - 1
 
 
 class Analysis:
@@ -22,21 +27,50 @@ class Analysis:
 
     def __init__(self, simulation: Simulation):
         self._simulation = simulation
+        # Sorted drawdowns per step, only valid for the paths they were computed from
+        self._sorted_drawdowns = {}
+        self._sorted_drawdowns_paths = None
+        self._returns_histogram = None
 
     @property
     def simulation(self) -> Simulation:
         return self._simulation
 
+    @staticmethod
+    def initial_drawdowns(paths: np.ndarray) -> np.ndarray:
+        """Computes the maximum drawdown from the first data point for each path at once.
+
+        Args:
+            paths (np.ndarray): A 2D array with one path per column, as in Simulation.paths.
+
+        Returns:
+            np.ndarray: The highest drawdown from the first data point of each path
+        """
+        return get_initial_drawdown(paths)
+
+    def get_returns_histogram(self, bins: int = 30) -> Tuple[np.ndarray, np.ndarray]:
+        """Bins the returns of the token pair into a density histogram.
+        The result is cached until the returns change.
+
+        Args:
+            bins (int): default 30. Number of bins.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The densities and the edges of the bins
+        """
+        returns = np.asarray(self._simulation.token_pair.returns, dtype=np.float64).ravel()
+        key = (bins, returns.shape, returns[0], returns[-1])
+
+        if self._returns_histogram is None or self._returns_histogram[0] != key:
+            counts, edges = np.histogram(returns, bins=bins, density=True)
+            self._returns_histogram = (key, counts, edges)
+        return self._returns_histogram[1:]
+
     # TODO: Refactor this, maybe even into a separate class for plots.
     def plot_returns(self, data_label, title, type="hist"):
         if type == "hist":
-            plt.hist(
-                self._simulation.token_pair.returns,
-                density=True,
-                bins=30,
-                alpha=0.5,
-                label=data_label,
-            )
+            counts, edges = self.get_returns_histogram(bins=30)
+            plt.stairs(counts, edges, fill=True, alpha=0.5, label=data_label)
             plt.ylabel("Occurences")
             plt.xlabel("Percentage change")
             plt.legend(loc="upper right")
@@ -49,9 +83,31 @@ class Analysis:
             f.suptitle("Path simulations n=" + str(length))
             subPlots.set_title(str(self._simulation.strategy))
 
-            for _, path in self._simulation.paths.iteritems():
+            for path in self._simulation.paths.to_numpy().T:
                 subPlots.plot(path)
 
+    def get_sorted_drawdowns(self, at_step: int = -1) -> np.ndarray:
+        """Returns the initial drawdowns of all paths up to the given step in ascending order.
+        The result is cached per step until the paths of the simulation change and is read-only.
+
+        Args:
+            at_step (int): default -1. The paths are truncated up to that step.
+
+        Returns:
+            np.ndarray: The sorted initial drawdowns
+        """
+        paths = self._simulation.paths
+        if paths is not self._sorted_drawdowns_paths:
+            self._sorted_drawdowns = {}
+            self._sorted_drawdowns_paths = paths
+
+        if at_step not in self._sorted_drawdowns:
+            sorted_drawdowns = np.sort(self.initial_drawdowns(paths.to_numpy()[:at_step]))
+            # Shared by all later queries, so it must not be changed in place by callers
+            sorted_drawdowns.setflags(write=False)
+            self._sorted_drawdowns[at_step] = sorted_drawdowns
+        return self._sorted_drawdowns[at_step]
+
     def get_simulated_var(self, alpha: float, at_step: int = None) -> float:
         """Estimates the premium multiplier for the threshold by getting the initial maxmimum drawdown of the i-th interval corrosponding to the given alpha.
         Example: alpha=0.99 means that the functions selects the maximum drawdown that corrosponds to the 99th-percentile/interval.
@@ -63,42 +119,69 @@ class Analysis:
         Returns:
             float: Returns the threshold multiplier
         """
+        return self.get_simulated_vars([alpha], at_step)[0]
+
+    def get_simulated_vars(self, alphas: Sequence[float], at_step: int = None) -> np.ndarray:
+        """Estimates the VaR for several confidence intervals at once, see get_simulated_var.
+        The drawdowns are only sorted once per step, so repeated queries just index into them.
+
+        Args:
+            alphas (Sequence[float]): Confidence intervals.
+            at_step (int): default None. If None, the whole time series is used for the estimation. If a step is given, the path is truncated up to that step.
+
+        Returns:
+            np.ndarray: Returns the VaR for each confidence interval
+        """
 
         at_step = -1 if at_step is None else at_step
 
         if at_step > len(self._simulation.paths[0]):
             raise Exception("Step must be smaller or equal to the length of the path.")
 
-        initial_drawdowns = []
-        for _, path in self._simulation.paths.items():
-            initial_drawdowns.append(get_initial_drawdown(path[:at_step]))
+        alphas = np.asarray(alphas, dtype=np.float64)
+        if not np.all((alphas >= 0) & (alphas < 1)):
+            raise Exception("Alpha must be greater or equal to 0 and smaller than 1.")
+
+        initial_drawdowns = self.get_sorted_drawdowns(at_step)
 
         # These drawdowns are being represented as negative percentage returns
-        # Sorting this in reverse order (descending) mean that the 99th percentile
-        # is the 99th percent lowest return
-        initial_drawdowns.sort(reverse=True)
+        # In descending order the 99th percentile is the 99th percent lowest return,
+        # which is the k-th smallest drawdown in the ascending order of the cache.
+        n = len(initial_drawdowns)
+        k = n - 1 - (n * alphas).astype(int)
 
         # This is the value at risk (VaR) at a given confidence interval (=alpha)
         # In this case, the VaR is represented as a negative number as it is the
         # n_th worst 'initial' drawdown of the simulation
-        return initial_drawdowns[int(len(initial_drawdowns) * alpha)]
+        return initial_drawdowns[k]
 
     def get_liquidation_threshold(self, TVL: int, debt_outstanding: int):
-        """Experimental WIP"""
+        """Experimental WIP
+
+        Returns:
+            Tuple[pd.DataFrame, pd.DataFrame]: The base and quote token reserves of the AMM for each step of each path.
+        """
         # It's assumed that the start of the strajectory is the unknown threshold x that has been reached at day 0.
         # From now on, arbitrageurs will buy iBTC and burn it in exchange for collateral.
-        for _, path in self._simulation.paths.iteritems():
-            for _, value in path.iteritems():
-
-                # would be better to calculate the price change from yesterday to today and pass this as the exact slippage parameter for a swap
-                # to align the AMM back to market prices instead of instantiating it new everytime which is also imprecise I think.
-                amm = Automted_Market_Maker(
-                    self.simulation.token_pair.base_token,
-                    self.simulation.token_pair.quote_token,
-                    base_token_amount=TVL / 2 / value,
-                    quote_token_amount=TVL / 2,
-                )
-
-                """
-                
-                """
+        prices = self._simulation.paths.to_numpy()
+
+        # One pool per path, all of them stepped at once. Each step, arbitrageurs align
+        # the pool with the simulated market price of that step.
+        amm = Automted_Market_Maker(
+            self.simulation.token_pair.base_token,
+            self.simulation.token_pair.quote_token,
+            base_token_amount=TVL / 2 / prices[0],
+            quote_token_amount=TVL / 2,
+        )
+
+        base_token_amounts = np.empty_like(prices)
+        quote_token_amounts = np.empty_like(prices)
+        for step, price in enumerate(prices):
+            amm.step(price)
+            base_token_amounts[step] = amm.base_token_amount
+            quote_token_amounts[step] = amm.quote_token_amount
+
+        return (
+            pd.DataFrame(base_token_amounts, columns=self._simulation.paths.columns),
+            pd.DataFrame(quote_token_amounts, columns=self._simulation.paths.columns),
+        )
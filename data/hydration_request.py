@@ -1,8 +1,15 @@
 from substrateinterface import SubstrateInterface
+from numba import njit
 import ssl
+import math
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import logging
+from collections import OrderedDict
+from functools import lru_cache
+import weakref
+from typing import Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +17,111 @@ urls = {
     "hydration": "wss://rpc.hydradx.cloud",
 }
 
+# Most recently used block hashes per client, released together with the client
+_block_hashes = weakref.WeakKeyDictionary()
+_block_hashes_maxsize = 1024
+
+
+@lru_cache(maxsize=1)
+def _default_client() -> SubstrateInterface:
+    """Lazily opens a single connection to the Hydration node that is shared by all requests."""
+    return SubstrateInterface(url=urls["hydration"], ws_options={'sslopt': {"cert_reqs": ssl.CERT_NONE}})
+
+
+@njit(cache=True)
+def _calc_d_n2(x: float, y: float, ann: float) -> Tuple[float, float]:
+    """Computes the Stableswap invariant D of a two token pool in closed form.
+
+    For two tokens the invariant reduces to the depressed cubic D^3 + p * D + q = 0 with
+    p = 4xy * (ann - 1) and q = -4xy * ann * (x + y), which has a single real root for ann > 1.
+    The root from Cardano's formula is refined with one Newton step to undo the cancellation
+    in u - p / (3u) for large amplifications.
+
+    Args:
+        x (float): Reserve of the first token.
+        y (float): Reserve of the second token.
+        ann (float): Amplification multiplied by the number of tokens in the pool.
+
+    Returns:
+        Tuple[float, float]: The invariant D and the product D * prod(D / (n * x)).
+    """
+    four_xy = 4.0 * x * y
+    p = four_xy * (ann - 1.0)
+    q = -four_xy * ann * (x + y)
+
+    u = (-0.5 * q + math.sqrt(0.25 * q * q + p * p * p / 27.0)) ** (1.0 / 3.0)
+    d = u - p / (3.0 * u)
+    d -= (d * d * d + p * d + q) / (3.0 * d * d + p)
+
+    return d, d * d * d / four_xy
+
+
+@njit(cache=True)
+def _calc_d(xp: np.ndarray, ann: float, precision: float, max_iter: int = 128) -> Tuple[float, float]:
+    """Computes the Stableswap invariant D with Newton's method.
+
+    Args:
+        xp (np.ndarray): Reserves of the tokens in the pool.
+        ann (float): Amplification multiplied by the number of tokens in the pool.
+        precision (float): Tolerance at which the iteration is considered to have converged.
+        max_iter (int, optional): Maximum number of iterations. Defaults to 128.
+
+    Returns:
+        Tuple[float, float]: The invariant D and the product D * prod(D / (n * x)) of the last
+            iteration, or NaN for both if the iteration did not converge.
+    """
+    n_coins = len(xp)
+    s = xp.sum()
+    if s == 0:
+        return 0.0, 0.0
+
+    if n_coins == 2 and ann > 1:
+        return _calc_d_n2(xp[0], xp[1], ann)
+
+    # d_p = d * prod(d / (n * x)) = d^(n+1) / (n^n * prod(x))
+    inv_denom = 1.0 / (xp.prod() * n_coins ** n_coins)
+    np1 = n_coins + 1
+
+    # Loop invariants of the Newton update
+    ann_s = ann * s
+    ann_m1 = ann - 1.0
+    n = float(n_coins)
+
+    d = s
+    for _ in range(max_iter):
+
+        d_p = d ** np1 * inv_denom
+
+        d_prev = d
+        d = (ann_s + d_p * n) * d / (ann_m1 * d + np1 * d_p)
+
+        if abs(d - d_prev) <= precision:
+            return d, d_p
+    return np.nan, np.nan
+
+
+@njit(cache=True)
+def _price_at_balance(xp: np.ndarray, i: int, j: int, ann: float, precision: float) -> float:
+    """Computes the spot price of token i in terms of token j for the given reserves.
+
+    Args:
+        xp (np.ndarray): Reserves of the tokens in the pool.
+        i (int): Index of the token that is priced.
+        j (int): Index of the token the price is denominated in.
+        ann (float): Amplification multiplied by the number of tokens in the pool.
+        precision (float): Tolerance used for computing the invariant D.
+
+    Returns:
+        float: The spot price.
+    """
+    # At convergence the product d_p of the Newton iteration equals c = D * prod(D / (n * x))
+    _, c = _calc_d(xp, ann, precision)
+
+    xi = xp[i]
+    xj = xp[j]
+
+    return xj * (ann * xi + c) / (ann * xj + c) / xi
+
 
 class Hydration_Token:
     """Class that represents a token"""
@@ -20,10 +132,13 @@ class Hydration_Token:
         Args:
             name (str): Name of the token which is used to identify the token in the data query so this must match the name of the token for the specific source.
             id (int): The Hydration identifier for the token in question.
+            decimals (int): Number of decimals of the on-chain token amounts.
         """
         self._id = id
         self._name = name
         self._decimals = decimals
+        # 10 ** decimals is exactly representable as a float up to 22 decimals
+        self._scale = 10.0 ** decimals
 
     @property
     def name(self) -> str:
@@ -37,6 +152,10 @@ class Hydration_Token:
     def decimals(self) -> int:
         return self._decimals
 
+    @property
+    def scale(self) -> float:
+        return self._scale
+
 
 # TODO: Add a default token argument that sets the quote currency to USD if nothing else is specified.
 class Stableswap_Pair:
@@ -112,7 +231,7 @@ class Stableswap_Pair:
     # Functions
     def get_price(
         self,
-        client: SubstrateInterface = SubstrateInterface(url=urls["hydration"], ws_options={'sslopt': {"cert_reqs": ssl.CERT_NONE}}),
+        client: SubstrateInterface = None,
         block_number: int = None,
         inverse: bool = False
     ) -> None:
@@ -125,6 +244,9 @@ class Stableswap_Pair:
             inverse (bool, optional): Coingecko does not support every token as quote currency. For exotic tokens as quote currency, this must be set to true so that the prices will be inverted. Defaults to False.
         """
 
+        if client is None:
+            client = _default_client()
+
         request = Hydration_Request(self, client, block_number)
         price = request.request_price()
         if not inverse:
@@ -140,7 +262,7 @@ class Hydration_Request:
     def __init__(
         self,
         token_pair: Stableswap_Pair,
-        client: SubstrateInterface,
+        client: SubstrateInterface = None,
         block_number: int = None
     ):
         """
@@ -151,7 +273,7 @@ class Hydration_Request:
         """
 
         self._token_pair = token_pair
-        self._client = client
+        self._client = client if client is not None else _default_client()
         self._block_number = block_number
 
     def fetch_current_block(self) -> int:
@@ -162,77 +284,64 @@ class Hydration_Request:
         return result.value
     
     def fetch_blockhash_by_block_number(self, block_number: int) -> str:
+        # The hash of a block never changes, so it can be cached across requests. Without a
+        # block number the node returns the hash of the current head, and for a block beyond
+        # the head it returns None. Neither is cached.
+        block_hashes = _block_hashes.setdefault(self._client, OrderedDict())
+        if block_number in block_hashes:
+            block_hashes.move_to_end(block_number)
+            return block_hashes[block_number]
+
         result = self._client.rpc_request(
             "chain_getBlockHash",
             [block_number]
         )
+        if block_number is not None and result['result'] is not None:
+            block_hashes[block_number] = result['result']
+            if len(block_hashes) > _block_hashes_maxsize:
+                block_hashes.popitem(last=False)
         return result['result']
 
-    def request_token_balances(self):
-        token_dict = {}
-        for token in (self._token_pair._base_token, self._token_pair._quote_token):
-            token_dict[token._id] = token
-        balances = {}
-        for k, dct in self._client.query_map(
-            module="Tokens", 
+    def request_token_balances(self) -> np.ndarray:
+        """Requests the balances of the pool account at the block of the request, or at the current block if none is given.
+
+        Returns:
+            np.ndarray: The balances of the base and the quote token, in that order.
+        """
+        tokens = (self._token_pair._base_token, self._token_pair._quote_token)
+        if self._block_number is None:
+            self._block_number = self.fetch_current_block()
+
+        block_hash = self.fetch_blockhash_by_block_number(self._block_number)
+        if block_hash is None:
+            raise Exception(f"Block {self._block_number} does not exist yet.")
+
+        accounts = self._client.query_map(
+            module="Tokens",
             storage_function="Accounts",
             params=[self._token_pair.account],
-            block_hash = self.fetch_blockhash_by_block_number(self._block_number)
-        ):
-            dct = dct.value_serialized
-            token = token_dict[k.value_serialized]
-            balance = dct.get('free')/ (10 ** token._decimals)
-
-            balances[token._name] = balance
-        return balances
-    
+            block_hash=block_hash
+        )
+        free = {k.value_serialized: dct.value_serialized.get('free') for k, dct in accounts}
+        return np.array([free[token._id] / token._scale for token in tokens], dtype=np.float64)
+
     def request_price(self):
-        if self._block_number is None:
-            self.block_number = self.fetch_current_block()
-        balances = self.request_token_balances()
-        return self.price_at_balance([balances[self._token_pair._base_token._name], balances[self._token_pair._quote_token._name]])
-
-    def calculate_d(self, balances, max_iterations=128) -> float:
-        reserves = balances
-        n_coins = len(balances)
-        ann = self._token_pair._amplification * n_coins
-        xp_sorted = sorted(reserves)
-        s = sum(xp_sorted)
-        if s == 0:
-            return 0
-
-        d = s
-        for i in range(max_iterations):
-
-            d_p = d
-            for x in xp_sorted:
-                d_p *= d / (x * len(balances))
-
-            d_prev = d
-            d = (ann * s + d_p * n_coins) * d / ((ann - 1) * d + (n_coins + 1) * d_p)
-
-            if self.has_converged(d_prev, d):
-                return d
-            
-    def has_converged(self, v0, v1) -> bool:
-        diff = abs(v0 - v1)
-        if (v1 <= v0 and diff < self._token_pair._precision) or (v1 > v0 and diff <= self._token_pair._precision):
-            return True
-        return False
-
-    def price_at_balance(self, balances: list, i: int = 1, j: int = 0):
-            n = len(balances)
-            ann = self._token_pair._amplification * n
-            d = self.calculate_d(balances)
-
-            c = d
-            sorted_bal = sorted(list(balances))
-            for x in sorted_bal:
-                c = c * d / (n * x)
-
-            xi = balances[i]
-            xj = balances[j]
-
-            p = xj * (ann * xi + c) / (ann * xj + c) / xi
-
-            return p
+        return self.price_at_balance(self.request_token_balances())
+
+    def calculate_d(self, balances: np.ndarray, max_iterations=128) -> Tuple[float, float]:
+        token_pair = self._token_pair
+        xp = np.asarray(balances, dtype=np.float64)
+        ann = float(token_pair._amplification * len(xp))
+        d, d_p = _calc_d(xp, ann, float(token_pair._precision), max_iterations)
+        if np.isnan(d):
+            raise Exception(f"The invariant D did not converge for balances {balances}.")
+        return d, d_p
+
+    def price_at_balance(self, balances: np.ndarray, i: int = 1, j: int = 0):
+        token_pair = self._token_pair
+        xp = np.asarray(balances, dtype=np.float64)
+        ann = float(token_pair._amplification * len(xp))
+        p = _price_at_balance(xp, i, j, ann, float(token_pair._precision))
+        if np.isnan(p):
+            raise Exception(f"The invariant D did not converge for balances {balances}.")
+        return p
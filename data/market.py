@@ -1,4 +1,5 @@
 from numpy import kaiser
+import numpy as np
 from data.data_request import Token
 from typing import Tuple
 
@@ -73,6 +74,25 @@ class Automted_Market_Maker():
         self._quote_token_amount -= amount / 2
         self.set_invariant()
 
+    def step(self, price) -> None:
+        """Arbitrages the pool to the given market price.
+
+        For a constant product pool the reserves after the arbitrage trade follow directly from the invariant,
+        so no swap amount has to be computed. The price and the reserves can also be numpy arrays to step
+        several pools at once.
+
+        Args:
+            price (float): The market price of the base token in units of the quote token.
+
+        Raises:
+            Exception: Raises an error if the swap type is not supported.
+        """
+        if self._swap_type != "CPF":
+            raise Exception("Arbitraging to a market price is only supported for CPF pools.")
+
+        self._base_token_amount = np.sqrt(self._invariant / price)
+        self._quote_token_amount = np.sqrt(self._invariant * price)
+
     # TODO: refacture swap and calculate_slippage!
 
     def exact_output_swap(self, output_token: Token, amount: int) -> None:
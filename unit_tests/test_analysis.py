@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pytest
+from analysis.analysis import Analysis, get_initial_drawdown
+from data.data_request import Token, Token_Pair
+from simulation.simulation import Simulation
+
+
+@pytest.fixture(scope="module")
+def simulation():
+    sim = Simulation(Token_Pair(Token("bitcoin", "BTC"), Token("usd", "USD")), strategy="GBM")
+    rng = np.random.default_rng(42)
+    sim.paths = pd.DataFrame(np.cumprod(1 + rng.normal(0, 0.05, size=(22, 997)), axis=0))
+    yield sim
+
+
+@pytest.mark.parametrize("alpha", [1.0, 1.5, -0.1, np.nan])
+def test_simulated_var_rejects_invalid_alpha(simulation: Simulation, alpha: float):
+    analysis = Analysis(simulation)
+
+    with pytest.raises(Exception, match="Alpha"):
+        analysis.get_simulated_var(alpha=alpha)
+
+    with pytest.raises(Exception, match="Alpha"):
+        analysis.get_simulated_vars(alphas=[0.5, alpha])
+
+
+@pytest.mark.parametrize("alpha", [0, 0.5, 0.9, 0.95, 0.99, 0.999])
+@pytest.mark.parametrize("at_step", [None, 1, 7, 14, 21])
+def test_simulated_var_matches_descending_sort(simulation: Simulation, alpha: float, at_step: int):
+    # Reference: the original selection, sorting the drawdowns of each path in
+    # descending order and taking the int(n * alpha)-th element
+    step = -1 if at_step is None else at_step
+    initial_drawdowns = [
+        min(path[:step]) / path.iloc[0] - 1 for _, path in simulation.paths.items()
+    ]
+    initial_drawdowns.sort(reverse=True)
+    expected = initial_drawdowns[int(len(initial_drawdowns) * alpha)]
+
+    assert Analysis(simulation).get_simulated_var(alpha=alpha, at_step=at_step) == expected
+
+
+def test_simulated_vars_match_single_queries(simulation: Simulation):
+    analysis = Analysis(simulation)
+    alphas = [0.9, 0.95, 0.99]
+
+    expected = [analysis.get_simulated_var(alpha=alpha, at_step=7) for alpha in alphas]
+
+    np.testing.assert_array_equal(analysis.get_simulated_vars(alphas=alphas, at_step=7), expected)
+
+
+def test_liquidation_threshold_arbitrages_pools_along_paths(simulation: Simulation):
+    base_token_amounts, quote_token_amounts = Analysis(simulation).get_liquidation_threshold(
+        TVL=1_000_000, debt_outstanding=0
+    )
+
+    assert base_token_amounts.shape == quote_token_amounts.shape == simulation.paths.shape
+    np.testing.assert_allclose(quote_token_amounts / base_token_amounts, simulation.paths)
+    np.testing.assert_allclose(
+        base_token_amounts * quote_token_amounts,
+        np.broadcast_to(1_000_000 ** 2 / 4 / simulation.paths.iloc[0].to_numpy(), simulation.paths.shape),
+    )
+
+
+def test_sorted_drawdowns_cannot_be_changed_in_place(simulation: Simulation):
+    analysis = Analysis(simulation)
+    var = analysis.get_simulated_var(alpha=0.99, at_step=7)
+
+    with pytest.raises(ValueError):
+        analysis.get_sorted_drawdowns(at_step=7)[::-1].sort()
+
+    assert analysis.get_simulated_var(alpha=0.99, at_step=7) == var
+
+
+def test_initial_drawdowns_match_single_series(simulation: Simulation):
+    drawdowns = Analysis.initial_drawdowns(simulation.paths.to_numpy())
+
+    for i, path in simulation.paths.items():
+        assert drawdowns[i] == get_initial_drawdown(path)
+
+
+@pytest.fixture
+def returns_analysis(simulation: Simulation):
+    token_pair = Token_Pair(Token("bitcoin", "BTC"), Token("usd", "USD"))
+    token_pair.returns = pd.DataFrame({"Price": np.random.default_rng(7).normal(0, 0.03, 365)})
+    sim = Simulation(token_pair, strategy="GBM")
+    sim.paths = simulation.paths
+    yield Analysis(sim)
+
+
+def test_returns_histogram_matches_numpy(returns_analysis: Analysis):
+    counts, edges = returns_analysis.get_returns_histogram()
+    expected_counts, expected_edges = np.histogram(
+        returns_analysis.simulation.token_pair.returns, bins=30, density=True
+    )
+
+    np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_array_equal(edges, expected_edges)
+
+
+def test_returns_histogram_is_cached(returns_analysis: Analysis):
+    counts, edges = returns_analysis.get_returns_histogram()
+    cached_counts, cached_edges = returns_analysis.get_returns_histogram()
+
+    assert cached_counts is counts
+    assert cached_edges is edges
+
+
+@pytest.mark.parametrize(
+    "change_returns",
+    [
+        lambda returns: returns.iloc[:-1],  # different shape
+        lambda returns: returns.assign(Price=returns["Price"].where(returns.index != 0, 0.5)),  # different first value
+        lambda returns: returns.assign(Price=returns["Price"].where(returns.index != 364, -0.5)),  # different last value
+    ],
+)
+def test_returns_histogram_is_recomputed_when_returns_change(returns_analysis: Analysis, change_returns):
+    counts, _ = returns_analysis.get_returns_histogram()
+    token_pair = returns_analysis.simulation.token_pair
+    token_pair.returns = change_returns(token_pair.returns)
+
+    new_counts, new_edges = returns_analysis.get_returns_histogram()
+
+    assert new_counts is not counts
+    expected_counts, expected_edges = np.histogram(token_pair.returns, bins=30, density=True)
+    np.testing.assert_array_equal(new_counts, expected_counts)
+    np.testing.assert_array_equal(new_edges, expected_edges)
+
+
+def test_returns_histogram_is_recomputed_when_bins_change(returns_analysis: Analysis):
+    returns_analysis.get_returns_histogram(bins=30)
+    counts, edges = returns_analysis.get_returns_histogram(bins=10)
+
+    assert len(counts) == 10
+    assert len(edges) == 11
@@ -0,0 +1,169 @@
+import numpy as np
+import pytest
+from data import hydration_request
+from data.hydration_request import (
+    Hydration_Request,
+    Hydration_Token,
+    Stableswap_Pair,
+    _calc_d,
+    _price_at_balance,
+)
+
+
+class Value:
+    def __init__(self, value):
+        self.value = value
+        self.value_serialized = value
+
+
+class Mock_Client:
+    """Stands in for a SubstrateInterface connected to a node whose head is at block 'head'."""
+
+    def __init__(self, head: int = 100):
+        self.head = head
+        self.rpc_calls = 0
+
+    def query(self, module, storage_function):
+        return Value(self.head)
+
+    def rpc_request(self, method, params):
+        self.rpc_calls += 1
+        block_number = self.head if params[0] is None else params[0]
+        if block_number > self.head:
+            return {"result": None}
+        return {"result": f"hash-{block_number}"}
+
+    def query_map(self, module, storage_function, params, block_hash):
+        self.block_hash = block_hash
+        return [(Value(19), Value({"free": 12_345_678_901})), (Value(11), Value({"free": 9_876_543_210}))]
+
+
+@pytest.fixture
+def stableswap_pair():
+    yield Stableswap_Pair(
+        Hydration_Token("wBTC", 19, 8), Hydration_Token("iBTC", 11, 8), "account", 5, 0.0004, 0.0001
+    )
+
+
+def test_block_hash_of_current_head_is_not_cached(stableswap_pair: Stableswap_Pair):
+    client = Mock_Client(head=100)
+    request = Hydration_Request(stableswap_pair, client)
+    assert request.fetch_blockhash_by_block_number(None) == "hash-100"
+
+    client.head = 200
+    assert request.fetch_blockhash_by_block_number(None) == "hash-200"
+
+
+def test_block_hash_beyond_head_is_not_cached(stableswap_pair: Stableswap_Pair):
+    client = Mock_Client(head=100)
+    request = Hydration_Request(stableswap_pair, client, 150)
+    assert request.fetch_blockhash_by_block_number(150) is None
+    with pytest.raises(Exception, match="does not exist"):
+        request.request_token_balances()
+
+    client.head = 200
+    assert request.fetch_blockhash_by_block_number(150) == "hash-150"
+    request.request_token_balances()
+    assert client.block_hash == "hash-150"
+
+
+def test_block_hash_is_cached_per_client(stableswap_pair: Stableswap_Pair):
+    client = Mock_Client(head=200)
+    Hydration_Request(stableswap_pair, client, 150).request_token_balances()
+    Hydration_Request(stableswap_pair, client, 150).request_token_balances()
+    assert client.rpc_calls == 1
+
+    other_client = Mock_Client(head=200)
+    Hydration_Request(stableswap_pair, other_client, 150).request_token_balances()
+    assert other_client.rpc_calls == 1
+
+
+def test_token_balances_default_to_current_block(stableswap_pair: Stableswap_Pair):
+    client = Mock_Client(head=100)
+    balances = Hydration_Request(stableswap_pair, client).request_token_balances()
+
+    assert client.block_hash == "hash-100"
+    assert balances.tolist() == [123.45678901, 98.7654321]
+
+
+def reference_d(balances: list, ann: float, precision: float, max_iterations: int = 1024) -> float:
+    """The general Newton iteration for D, as Hydration_Request.calculate_d used to compute it."""
+    n_coins = len(balances)
+    s = sum(balances)
+    d = s
+    for _ in range(max_iterations):
+        d_p = d
+        for x in balances:
+            d_p *= d / (x * n_coins)
+
+        d_prev = d
+        d = (ann * s + d_p * n_coins) * d / ((ann - 1) * d + (n_coins + 1) * d_p)
+
+        if abs(d - d_prev) <= precision:
+            return d
+
+
+def reference_price(balances: list, ann: float, precision: float, i: int = 1, j: int = 0) -> float:
+    d = reference_d(balances, ann, precision)
+    c = d
+    for x in balances:
+        c = c * d / (len(balances) * x)
+    return balances[j] * (ann * balances[i] + c) / (ann * balances[j] + c) / balances[i]
+
+
+@pytest.mark.parametrize(
+    "balances",
+    [
+        [100.0, 100.0],  # balanced
+        [123.45678901, 98.7654321],
+        [1e6, 1.0],  # highly imbalanced
+        [1.0, 1e6],
+        [3e-3, 7e-3],
+    ],
+)
+@pytest.mark.parametrize("ann", [0.5, 1.0, 1.5, 10.0, 400.0, 4000.0])
+def test_d_and_price_match_reference_newton(balances: list, ann: float):
+    # ann <= 1 is solved by the general Newton iteration, larger ones by the closed form
+    precision = 1e-12 * sum(balances)
+    xp = np.array(balances)
+
+    d, d_p = _calc_d(xp, ann, precision)
+    assert d == pytest.approx(reference_d(balances, ann, precision), rel=1e-9)
+    assert d_p == pytest.approx(d ** 3 / (4 * balances[0] * balances[1]), rel=1e-9)
+
+    price = _price_at_balance(xp, 1, 0, ann, precision)
+    assert price == pytest.approx(reference_price(balances, ann, precision), rel=1e-7)
+
+
+def test_d_matches_reference_newton_for_three_tokens():
+    balances = [1e6, 3.0, 5.0]
+    precision = 1e-9
+
+    d, _ = _calc_d(np.array(balances), 3 * 50.0, precision)
+
+    assert d == pytest.approx(reference_d(balances, 3 * 50.0, precision), rel=1e-9)
+
+
+def test_non_converging_d_raises(stableswap_pair: Stableswap_Pair):
+    request = Hydration_Request(stableswap_pair, Mock_Client())
+    stableswap_pair._amplification = 2000
+    stableswap_pair._precision = 0.0
+
+    with pytest.raises(Exception, match="did not converge"):
+        request.calculate_d(np.array([1e6, 1.0, 5.0]))
+
+    with pytest.raises(Exception, match="did not converge"):
+        request.price_at_balance(np.array([1e6, 1.0, 5.0]))
+
+
+def test_block_hash_cache_is_bounded(stableswap_pair: Stableswap_Pair, monkeypatch):
+    monkeypatch.setattr(hydration_request, "_block_hashes_maxsize", 2)
+    client = Mock_Client(head=200)
+    request = Hydration_Request(stableswap_pair, client)
+
+    for block_number in (150, 151, 150, 152):
+        request.fetch_blockhash_by_block_number(block_number)
+    assert list(hydration_request._block_hashes[client]) == [150, 152]
+
+    request.fetch_blockhash_by_block_number(151)
+    assert client.rpc_calls == 4
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from data.market import Automted_Market_Maker
+from unit_tests.conftest import *
+
+
+@pytest.mark.parametrize("price", [0.5, 1.0, 37_000.0])
+def test_step_arbitrages_pool_to_price(BTC: Token, USD: Token, price: float):
+    amm = Automted_Market_Maker(BTC, USD, base_token_amount=10, quote_token_amount=300_000)
+    invariant = amm.invariant
+
+    amm.step(price)
+
+    assert amm.base_token_amount * amm.quote_token_amount == pytest.approx(invariant)
+    assert amm.quote_token_amount / amm.base_token_amount == pytest.approx(price)
+
+
+def test_step_arbitrages_pools_to_prices(BTC: Token, USD: Token):
+    prices = np.array([0.5, 1.0, 37_000.0])
+    amm = Automted_Market_Maker(BTC, USD, base_token_amount=300_000 / prices, quote_token_amount=300_000)
+    invariant = amm.invariant
+
+    amm.step(prices * 1.1)
+
+    np.testing.assert_allclose(amm.base_token_amount * amm.quote_token_amount, invariant)
+    np.testing.assert_allclose(amm.quote_token_amount / amm.base_token_amount, prices * 1.1)
+
+
+def test_step_requires_constant_product_pool(BTC: Token, USD: Token):
+    amm = Automted_Market_Maker(BTC, USD, base_token_amount=10, quote_token_amount=300_000, swap_type="stableswap")
+
+    with pytest.raises(Exception):
+        amm.step(30_000)